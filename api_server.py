@@ -1,9 +1,18 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
+import hmac
+import math
+import os
 import uvicorn
+from starlette.concurrency import run_in_threadpool
 from judol_detector import JudolDetector
+from html_stream import StreamingHTMLAnalyzer, StreamLimitExceeded
+from traffic_log import TrafficRecorder
+from request_control import SingleFlight, TokenBucketLimiter, client_address, content_fingerprint, parse_trusted_proxies
+import profiling
 import logging
 
 # Configure logging
@@ -28,12 +37,33 @@ app.add_middleware(
 # Initialize detector
 detector = JudolDetector()
 
+# Optional sampled request recording for shadow evaluation (see shadow_eval.py)
+recorder = TrafficRecorder.from_env()
+
+# Identical in-flight analyses share one computation; each client is rate limited
+inflight = SingleFlight()
+rate_limiter = TokenBucketLimiter.from_env()
+# Reverse proxies whose X-Forwarded-For is believed when identifying clients
+trusted_proxies = parse_trusted_proxies(os.environ.get("JUDOL_TRUSTED_PROXIES", ""))
+
+# Largest document accepted by the streaming endpoint
+STREAM_MAX_BYTES = int(os.environ.get("JUDOL_STREAM_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# Admin endpoints are disabled unless a token is configured
+ADMIN_TOKEN = os.environ.get("JUDOL_ADMIN_TOKEN")
+profiling.trace_sample_rate = float(os.environ.get("JUDOL_TRACE_SAMPLE_RATE", "0"))
+
+# The model stage only runs once a trained model is loaded (see train.py)
+if os.environ.get("JUDOL_LOAD_MODEL", "false").lower() == "true":
+    detector.load_model()
+
 # --- New Pydantic Models for Simplified API ---
 
 class AnalysisDetail(BaseModel):
     matched_keywords: Optional[List[str]] = None
     keyword_score: Optional[float] = None
     regex_score: Optional[float] = None
+    model_confidence: Optional[float] = None
 
 class AnalysisResult(BaseModel):
     is_gambling: bool
@@ -46,9 +76,93 @@ class HTMLAnalysisRequest(BaseModel):
     html: str
     url: Optional[str] = None
     image_urls: Optional[List[str]] = None
+    budget_ms: Optional[float] = Field(None, gt=0)
+
+class DetailedAnalysisResponse(BaseModel):
+    results: List[AnalysisResult]
+    confidence: float
+    stages_run: List[str]
+    budget_exhausted: bool
+    elapsed_ms: float
+
+class ProfilingSettings(BaseModel):
+    trace_sample_rate: float = Field(..., ge=0.0, le=1.0)
 
 # --- End of Pydantic Models ---
 
+def enforce_rate_limit(http_request: Request):
+    """Raises a 429 when the calling client has exhausted its token bucket."""
+    if rate_limiter is None:
+        return
+    client_id = client_address(
+        http_request.client.host if http_request.client else "unknown",
+        http_request.headers.get("x-forwarded-for"),
+        trusted_proxies
+    )
+    retry_after = rate_limiter.acquire(client_id)
+    if retry_after > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many analysis requests",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+
+def require_admin(http_request: Request):
+    """Rejects admin calls that do not carry the configured admin token."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+    token = http_request.headers.get("x-admin-token", "")
+    # Constant-time comparison so the token cannot be guessed byte by byte
+    if not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+def run_analysis(html, url=None, image_urls=None, budget_ms=None, force_trace=False):
+    """Runs the tiered detector, tracing it when forced or sampled. Returns (report, trace)."""
+    with profiling.trace("analyze_html", force=force_trace, url=url) as trace:
+        report = detector.analyze_html_tiered(
+            html_content=html,
+            base_url=url,
+            image_urls=image_urls,
+            budget_ms=budget_ms
+        )
+    if trace is not None:
+        logger.info(f"Trace {trace.id}: {trace.server_timing()}")
+    return report, trace
+
+async def analyze(request: HTMLAnalysisRequest, http_request: Request, response: Response):
+    """Shared body of the HTML analysis endpoints. Returns the tiered analysis report."""
+    enforce_rate_limit(http_request)
+
+    # Serializing and appending a whole page is blocking I/O; only sampled
+    # requests pay for the trip to the threadpool
+    if recorder and recorder.sampled():
+        await run_in_threadpool(recorder.record, request.html, url=request.url, image_urls=request.image_urls)
+
+    force_trace = http_request.headers.get("x-judol-trace", "").lower() in ("1", "true")
+    try:
+        # Pass the pre-filtered image list to the detector
+        if force_trace:
+            # Traced requests get their own run so the trace is theirs alone
+            report, trace = await run_in_threadpool(
+                run_analysis, request.html, request.url, request.image_urls, request.budget_ms, True
+            )
+        else:
+            # Concurrent identical requests wait on the same computation
+            key = f"{content_fingerprint(request.html, request.url, request.image_urls)}:{request.budget_ms}"
+            report, trace = await inflight.do(key, lambda: run_in_threadpool(
+                run_analysis, request.html, request.url, request.image_urls, request.budget_ms
+            ))
+    except Exception as e:
+        logger.error(f"Error analyzing HTML: {e}", exc_info=True)
+        # Re-raise as HTTPException to be handled by FastAPI
+        raise HTTPException(status_code=500, detail=f"HTML analysis error: {str(e)}")
+
+    if trace is not None:
+        response.headers["Server-Timing"] = trace.server_timing()
+        response.headers["X-Judol-Trace-Id"] = trace.id
+    response.headers["X-Judol-Stages"] = ",".join(report["stages_run"])
+    return report
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -59,21 +173,68 @@ async def root():
     }
 
 @app.post("/analyze/html", response_model=List[AnalysisResult])
-async def analyze_html(request: HTMLAnalysisRequest):
-    """Analyze HTML content for judol content based on text and image URLs."""
+async def analyze_html(request: HTMLAnalysisRequest, http_request: Request, response: Response):
+    """
+    Analyze HTML content for judol content based on text and image URLs.
+    The stages that ran are listed in the X-Judol-Stages header. Send
+    `X-Judol-Trace: 1` to trace this request; its stage timings are
+    returned in the Server-Timing header.
+    """
+    report = await analyze(request, http_request, response)
+    return report["results"]
+
+@app.post("/analyze/html/detailed", response_model=DetailedAnalysisResponse)
+async def analyze_html_detailed(request: HTMLAnalysisRequest, http_request: Request, response: Response):
+    """
+    Same analysis as /analyze/html, returned with the page confidence, the
+    detection stages that ran and whether the latency budget ran out.
+    """
+    return await analyze(request, http_request, response)
+
+@app.post("/analyze/html/stream", response_model=List[AnalysisResult])
+async def analyze_html_stream(request: Request, response: Response, url: Optional[str] = None):
+    """
+    Analyze raw HTML sent as the request body (chunked or octet-stream).
+
+    The body is parsed and scored as it arrives instead of being buffered,
+    so memory per request stays bounded. Once the text verdict saturates
+    the rest of the body is not read. Bodies over JUDOL_STREAM_MAX_BYTES
+    are rejected with 413.
+    """
+    enforce_rate_limit(request)
+
+    content_length = request.headers.get('content-length', '')
+    if content_length.isdigit() and int(content_length) > STREAM_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Body exceeds {STREAM_MAX_BYTES} bytes")
+
+    charset = 'utf-8'
+    content_type = request.headers.get('content-type', '')
+    for param in content_type.split(';')[1:]:
+        name, _, value = param.strip().partition('=')
+        if name.lower() == 'charset' and value:
+            charset = value.strip('"')
+
     try:
-        # Pass the pre-filtered image list to the detector
-        results = detector.analyze_html_content(
-            html_content=request.html, 
-            base_url=request.url,
-            image_urls=request.image_urls
-        )
-        return results
+        analyzer = StreamingHTMLAnalyzer(detector, base_url=url, encoding=charset, max_bytes=STREAM_MAX_BYTES)
+    except LookupError:
+        raise HTTPException(status_code=415, detail=f"Unsupported charset: {charset}")
+
+    try:
+        # Parsing and scoring are CPU-bound, so keep them off the event loop
+        async for chunk in request.stream():
+            if await run_in_threadpool(analyzer.feed_bytes, chunk):
+                break
+        results = await run_in_threadpool(analyzer.finish)
+    except StreamLimitExceeded as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
-        logger.error(f"Error analyzing HTML: {e}", exc_info=True)
-        # Re-raise as HTTPException to be handled by FastAPI
+        logger.error(f"Error analyzing streamed HTML: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"HTML analysis error: {str(e)}")
 
+    response.headers["X-Judol-Bytes-Read"] = str(analyzer.bytes_read)
+    response.headers["X-Judol-Early-Verdict"] = "true" if analyzer.saturated else "false"
+    return results
+
 @app.get("/keywords")
 async def get_keywords():
     """Get all keywords and regex patterns"""
@@ -91,7 +252,9 @@ async def health_check():
             "status": "healthy",
             "keywords_loaded": keywords_ok,
             "total_keywords": len(detector.keywords),
-            "total_regex": len(detector.regex_patterns)
+            "total_regex": len(detector.regex_patterns),
+            "inflight_analyses": len(inflight),
+            "coalesced_requests": inflight.coalesced
         }
     except Exception as e:
         return {
@@ -99,6 +262,44 @@ async def health_check():
             "error": str(e)
         }
 
+@app.get("/admin/profiling")
+async def get_profiling(http_request: Request):
+    """Current trace sampling settings"""
+    require_admin(http_request)
+    return {
+        "trace_sample_rate": profiling.trace_sample_rate,
+        "recent_traces": len(profiling.recent_traces)
+    }
+
+@app.post("/admin/profiling")
+async def set_profiling(settings: ProfilingSettings, http_request: Request):
+    """Change the fraction of requests traced at runtime (0 turns tracing off)"""
+    require_admin(http_request)
+    profiling.trace_sample_rate = settings.trace_sample_rate
+    logger.info(f"Trace sample rate set to {settings.trace_sample_rate}")
+    return {"trace_sample_rate": profiling.trace_sample_rate}
+
+@app.get("/admin/traces")
+async def get_traces(http_request: Request, limit: int = Query(20, ge=1)):
+    """Most recent traces recorded by this worker, newest first"""
+    require_admin(http_request)
+    traces = list(profiling.recent_traces)[-limit:]
+    return [trace.to_dict() for trace in reversed(traces)]
+
+@app.get("/admin/profile", response_class=PlainTextResponse)
+async def get_profile(http_request: Request, seconds: float = 10.0, interval_ms: float = 10.0):
+    """
+    Sampling profile of this worker's busy threads over a time window,
+    in collapsed-stack format for flamegraph tools.
+    """
+    require_admin(http_request)
+    seconds = min(max(seconds, 0.1), 60.0)
+    interval = max(interval_ms, 1.0) / 1000
+    stacks = await run_in_threadpool(profiling.sample_stacks, seconds, interval)
+    if stacks is None:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    return stacks
+
 if __name__ == "__main__":
     uvicorn.run(
         "api_server:app",
@@ -0,0 +1,234 @@
+import codecs
+import re
+from html.parser import HTMLParser
+
+
+# Text buffered between flushes is capped so a single huge text node
+# cannot grow the working set; matches across flushes are still caught
+# through the overlap tail kept in `_KeywordScanner`.
+MAX_TEXT_BUFFER = 64 * 1024
+
+# Input the parser may hold back while waiting for a construct to end
+# (a <script>/<style> body, a comment, or a tag). Script, style and comment
+# content is never scored, so beyond this size it is dropped, keeping only
+# enough of the end to recognise the terminator; an unterminated tag that
+# grows past it is rejected.
+MAX_PENDING_INPUT = 1024 * 1024
+PENDING_TAIL = 1024
+
+# Elements whose content BeautifulSoup's get_text() does not return.
+SKIPPED_TAGS = {'script', 'style', 'template'}
+
+
+class StreamLimitExceeded(ValueError):
+    """Raised when a streamed document exceeds the analyzer's input limits."""
+
+
+class _KeywordScanner:
+    """
+    Incrementally scores text against the detector's Aho-Corasick automaton
+    and regex patterns, holding only a short tail of previously seen text.
+    """
+
+    def __init__(self, detector):
+        self.detector = detector
+        self.keyword_score = 0
+        self.regex_score = 0
+        self._matched_patterns = set()
+        self._compiled = [
+            (re.compile(pattern_data['keyword']), pattern_data['score'])
+            for pattern_data in detector.regex_patterns
+        ]
+        longest = max((len(k['keyword']) for k in detector.keywords), default=1)
+        # Regex patterns are short literals with optional digit runs; keep
+        # enough context for either kind of match to straddle a boundary.
+        self.overlap = max(longest, 16) - 1
+        self._tail = ''
+
+    @property
+    def total_score(self):
+        return self.keyword_score + self.regex_score
+
+    def feed(self, text):
+        window = self._tail + text.lower()
+        boundary = len(self._tail)
+
+        # Only count keyword hits that end in the new text so occurrences
+        # inside the overlap tail are never counted twice.
+        for end_index, (keyword, score) in self.detector.automaton.iter(window):
+            if end_index >= boundary:
+                self.keyword_score += score
+
+        # Regex patterns contribute once each, like extract_keyword_features
+        for idx, (pattern, score) in enumerate(self._compiled):
+            if idx not in self._matched_patterns and pattern.search(window):
+                self._matched_patterns.add(idx)
+                self.regex_score += score
+
+        self._tail = window[-self.overlap:] if self.overlap > 0 else ''
+
+
+class StreamingHTMLAnalyzer(HTMLParser):
+    """
+    Analyzes an HTML document fed in byte chunks as they arrive.
+
+    Text content is scored incrementally and <img> sources are checked as
+    soon as their tags are parsed, so memory use is bounded by the chunk
+    size rather than by the size of the document. Once the text score
+    saturates the verdict can no longer change and `saturated` is set,
+    letting the caller stop reading the rest of the body. Documents larger
+    than `max_bytes` raise StreamLimitExceeded.
+    """
+
+    def __init__(self, detector, base_url=None, encoding='utf-8', max_results=200, max_bytes=None):
+        super().__init__(convert_charrefs=True)
+        self.detector = detector
+        self.base_url = base_url
+        self.max_results = max_results
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+        self.saturated = False
+        self.image_results = []
+        self._scanner = _KeywordScanner(detector)
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        self._skip_depth = 0
+        self._text_parts = []
+        self._text_size = 0
+        # Whether part of the current text node was already fed by a forced flush
+        self._node_started = False
+
+    # --- Feeding -----------------------------------------------------------
+
+    def feed_bytes(self, chunk):
+        """Feeds a chunk of raw bytes. Returns True once the verdict has saturated."""
+        if self.saturated or not chunk:
+            return self.saturated
+        self.bytes_read += len(chunk)
+        if self.max_bytes is not None and self.bytes_read > self.max_bytes:
+            raise StreamLimitExceeded(f"Document exceeds {self.max_bytes} bytes")
+        self.feed(self._decoder.decode(chunk))
+        if self._text_size >= MAX_TEXT_BUFFER:
+            self._flush_text(node_end=False)
+        if len(self.rawdata) > MAX_PENDING_INPUT:
+            self._trim_pending_input()
+        return self.saturated
+
+    def finish(self):
+        """Flushes any buffered input and returns the analysis results."""
+        if not self.saturated:
+            self.feed(self._decoder.decode(b'', final=True))
+            self.close()
+        self._flush_text()
+        return self.results()
+
+    def results(self):
+        results = []
+        confidence = min(1.0, self._scanner.total_score / 20.0)
+        if confidence > 0.5:
+            results.append({
+                'is_gambling': True,
+                'confidence': confidence,
+                'selector': 'body',
+                'type': 'text',
+                'details': {
+                    'type': 'text',
+                    'keyword_score': self._scanner.keyword_score,
+                    'regex_score': self._scanner.regex_score
+                }
+            })
+        results.extend(self.image_results)
+        return results
+
+    # --- HTMLParser callbacks -----------------------------------------------
+
+    def handle_starttag(self, tag, attrs):
+        self._flush_text()
+        if tag in SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag == 'img':
+            self._handle_image(dict(attrs).get('src'))
+
+    def handle_startendtag(self, tag, attrs):
+        self._flush_text()
+        if tag == 'img':
+            self._handle_image(dict(attrs).get('src'))
+
+    def handle_endtag(self, tag):
+        self._flush_text()
+        if tag in SKIPPED_TAGS and self._skip_depth > 0:
+            self._skip_depth -= 1
+
+    def handle_data(self, data):
+        if self._skip_depth or self.saturated:
+            return
+        self._text_parts.append(data)
+        self._text_size += len(data)
+
+    # --- Internals ----------------------------------------------------------
+
+    def _flush_text(self, node_end=True):
+        """
+        Scores buffered text. At a real node boundary the node is stripped and
+        separated from the previous one, mirroring get_text(separator=' ',
+        strip=True). A forced mid-node flush (`node_end=False`) feeds the text
+        as a continuation and holds back trailing whitespace, which is only
+        stripped if the node ends there.
+        """
+        if not self._text_parts:
+            if node_end:
+                self._node_started = False
+            return
+        text = ''.join(self._text_parts)
+        self._text_parts = []
+        self._text_size = 0
+        if self.saturated:
+            return
+
+        prefix = ''
+        if not self._node_started:
+            text = text.lstrip()
+            prefix = ' '
+        if node_end:
+            text = text.rstrip()
+            self._node_started = False
+        else:
+            core = text.rstrip()
+            held = text[len(core):]
+            text = core
+            if held and (core or self._node_started):
+                # A whitespace run longer than any keyword cannot be matched
+                # across, so it only needs to be kept up to that length.
+                held = held[:self._scanner.overlap]
+                self._text_parts = [held]
+                self._text_size = len(held)
+            if text:
+                self._node_started = True
+        if not text:
+            return
+
+        self._scanner.feed(prefix + text)
+        if self._scanner.total_score >= 20:
+            self.saturated = True
+
+    def _trim_pending_input(self):
+        """
+        Bounds the input HTMLParser holds back while a construct is still
+        open. `rawdata` then starts at that construct: the pending content of
+        a <script>/<style> element, or a comment or tag that has not closed.
+        """
+        if self.cdata_elem:
+            # Raw script/style text; only the closing tag matters
+            self.rawdata = self.rawdata[-PENDING_TAIL:]
+        elif self.rawdata.startswith('<!--'):
+            self.rawdata = '<!--' + self.rawdata[-PENDING_TAIL:]
+        else:
+            raise StreamLimitExceeded(
+                f"Unterminated markup exceeds {MAX_PENDING_INPUT} characters"
+            )
+
+    def _handle_image(self, src):
+        if not src or len(self.image_results) >= self.max_results:
+            return
+        result = self.detector.analyze_image_url(src)
+        if result:
+            self.image_results.append(result)
@@ -5,6 +5,7 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import classification_report, accuracy_score
 import pickle
+import scipy.sparse as sp
 import re
 import nltk
 from nltk.corpus import stopwords
@@ -12,16 +13,24 @@ from nltk.tokenize import word_tokenize
 import os
 import io
 import requests
-import redis
 import json
+import time
 import ahocorasick
 import polars as pl
 from urllib.parse import urljoin
 from bs4 import BeautifulSoup
 from urllib.parse import urlparse
+from verdict_cache import build_cache, DEFAULT_TTL
+import profiling
 
 class JudolDetector:
-    def __init__(self, keywords_file='keywords.csv'):
+    # <meta> name/property values whose content is scored by the head tier
+    HEAD_META_NAMES = {
+        'description', 'keywords', 'og:title', 'og:description',
+        'og:site_name', 'twitter:title', 'twitter:description'
+    }
+
+    def __init__(self, keywords_file='keywords.csv', regex_patterns=None, use_cache=True, cache=None):
         # --- Polars Optimization for loading keywords from CSV ---
         try:
             keyword_df = pl.read_csv(keywords_file)
@@ -49,7 +58,9 @@ class JudolDetector:
             {'keyword': r'88', 'score': 10},
             {'keyword': r'89', 'score': 10},
         ]
-        print(f"✅ Loaded {len(self.regex_patterns)} hardcoded regex patterns.")
+        if regex_patterns is not None:
+            self.regex_patterns = regex_patterns
+        print(f"✅ Loaded {len(self.regex_patterns)} regex patterns.")
 
         # --- Aho-Corasick for fast exact keyword matching ---
         self.automaton = ahocorasick.Automaton()
@@ -60,7 +71,25 @@ class JudolDetector:
         
         self.vectorizer = TfidfVectorizer(max_features=5000)
         self.model = None
-        self.redis_client = redis.StrictRedis(host='redis', port=6379, db=0)
+        # Whether the loaded model expects the keyword/regex scores as extra columns
+        self.model_keyword_features = False
+        # Verdict cache backend is chosen by JUDOL_CACHE_BACKEND unless one is passed in
+        self.cache_ttl = int(os.environ.get('JUDOL_CACHE_TTL', str(DEFAULT_TTL)))
+        if cache is None and use_cache:
+            cache = build_cache(ttl=self.cache_ttl)
+        self.cache = cache
+
+        # --- Tiered analysis settings ---
+        budget = os.environ.get('JUDOL_STAGE_BUDGET_MS')
+        self.stage_budget_ms = float(budget) if budget else None
+        # name -> (is_available, stage); unavailable stages are skipped entirely
+        self.expensive_stage_handlers = {
+            'model': (lambda: self.model is not None, self._model_stage),
+        }
+        self.expensive_stages = [
+            name.strip() for name in os.environ.get('JUDOL_EXPENSIVE_STAGES', 'model').split(',')
+            if name.strip()
+        ]
 
         # Download necessary NLTK data if not present
         try:
@@ -112,20 +141,22 @@ class JudolDetector:
         If not, it can eventually fall back to a trained text classifier model (future).
         """
         
-        processed_text = self.preprocess_text(text)
+        with profiling.span('preprocess', chars=len(text) if isinstance(text, str) else 0):
+            processed_text = self.preprocess_text(text)
         
         # Check cache first
-        try:
-            cached_result = self.redis_client.get(f"judol-text:{processed_text}")
-            if cached_result:
+        cache_key = f"judol-text:{processed_text}"
+        if self.cache is not None:
+            with profiling.span('cache_get'):
+                cached_result = self.cache.get(cache_key)
+            if cached_result is not None:
                 print("✅ Text cache hit")
-                return json.loads(cached_result)
-        except redis.exceptions.RedisError as e:
-            print(f"⚠️ Redis cache read error: {e}")
+                return cached_result
 
 
         # --- Keyword & Regex Analysis ---
-        keyword_features = self.extract_keyword_features(text) # Use original text for keywords
+        with profiling.span('keywords'):
+            keyword_features = self.extract_keyword_features(text) # Use original text for keywords
         total_score = keyword_features['keyword_score'] + keyword_features['regex_score']
         
         # The confidence is normalized based on an arbitrary max score.
@@ -145,10 +176,9 @@ class JudolDetector:
         }
         
         # Cache the result
-        try:
-            self.redis_client.setex(f"judol-text:{processed_text}", 3600, json.dumps(result))
-        except redis.exceptions.RedisError as e:
-            print(f"⚠️ Redis cache write error: {e}")
+        if self.cache is not None:
+            with profiling.span('cache_set'):
+                self.cache.set(cache_key, result, self.cache_ttl)
 
         return result
 
@@ -157,52 +187,208 @@ class JudolDetector:
         """
         Analyzes the HTML content for gambling-related material.
         It checks text content and image URLs.
+        Returns only the result list; see analyze_html_tiered for the stages.
         """
+        return self.analyze_html_tiered(html_content, base_url=base_url, image_urls=image_urls)['results']
+
+    def analyze_html_tiered(self, html_content, base_url=None, image_urls=None,
+                            budget_ms=None, expensive_stages=None):
+        """
+        Analyzes the page in tiers of increasing cost and stops as soon as the
+        verdict is settled:
+
+        1. url: keywords in the page URL. This is only a hint: it never
+           produces a verdict on its own, but keeps a page whose text has no
+           keyword or pattern hit from being settled as clean
+        2. head: title and meta description/keywords
+        3. body: all text content. A page whose text has no keyword or
+           pattern hit (and no URL hint) is settled as clean here, so the
+           expensive stages are skipped
+        4. images: image URLs
+        5. expensive stages listed in `expensive_stages` (e.g. 'model')
+
+        Once the page verdict is settled (its confidence saturates, or it is
+        known to be clean) the remaining verdict tiers are skipped, and no
+        verdict tier starts after `budget_ms` has elapsed. The images tier
+        always runs: its per-image selectors are what clients act on. The
+        document is parsed once and shared by the head, body and images
+        tiers. Each stage is recorded as a span when the request is traced.
+        """
+        started = time.perf_counter()
+        if budget_ms is None:
+            budget_ms = self.stage_budget_ms
+        if expensive_stages is None:
+            expensive_stages = self.expensive_stages
+
+        # (name, stage, refines the page verdict, skipped once the page is clean)
+        stages = [
+            ('url', self._url_stage, True, False),
+            ('head', self._head_stage, True, False),
+            ('body', self._body_stage, True, False),
+            ('images', self._images_stage, False, False),
+        ]
+        for name in expensive_stages:
+            is_available, stage = self.expensive_stage_handlers.get(name, (None, None))
+            if stage is not None and is_available():
+                stages.append((name, stage, True, True))
+
+        state = {
+            'html': html_content,
+            'base_url': base_url,
+            'image_urls': image_urls,
+            'soup': None,
+            'text': None,
+            'confidence': 0.0,
+            'details': None,
+            'url_hint': None,
+            'clean': False,
+            'image_results': []
+        }
+        profiling.annotate(html_chars=len(html_content))
+
+        stages_run = []
+        budget_exhausted = False
+        for name, stage, refines_verdict, skipped_when_clean in stages:
+            if refines_verdict:
+                if state['confidence'] >= 1.0 or (state['clean'] and skipped_when_clean):
+                    continue
+                if budget_ms is not None and (time.perf_counter() - started) * 1000 >= budget_ms:
+                    budget_exhausted = True
+                    continue
+            with profiling.span(name):
+                stage(state)
+            stages_run.append(name)
+
         results = []
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
-        # 1. Analyze all text content from the page
-        all_text = soup.get_text(separator=' ', strip=True)
-        text_prediction = self.predict(all_text)
-        if text_prediction['is_gambling']:
+        if state['confidence'] > 0.5:
             results.append({
                 'is_gambling': True,
-                'confidence': text_prediction['confidence'],
+                'confidence': state['confidence'],
                 'selector': 'body',
                 'type': 'text',
-                'details': text_prediction['details']
+                'details': state['details']
             })
+        results.extend(state['image_results'])
+
+        return {
+            'results': results,
+            'confidence': state['confidence'],
+            'stages_run': stages_run,
+            'budget_exhausted': budget_exhausted,
+            'elapsed_ms': (time.perf_counter() - started) * 1000
+        }
+
+    def _raise_confidence(self, state, confidence, details):
+        """Keeps the strongest page-level signal seen so far."""
+        if confidence > state['confidence'] or state['details'] is None:
+            state['confidence'] = confidence
+            state['details'] = details
+
+    def _url_stage(self, state):
+        base_url = state['base_url']
+        if not base_url:
+            return
+        # Only the host and path: query strings carry user input such as searches
+        try:
+            parsed = urlparse(base_url)
+            page_url = f"{parsed.netloc}{parsed.path}"
+        except Exception:
+            page_url = base_url
+        # Substring matches in host names are too weak for a verdict, so
+        # the URL only decides whether a keyword-free page may be settled
+        state['url_hint'] = self._analyze_url_for_keywords(page_url)
+
+    def _head_stage(self, state):
+        # The document is parsed once here and reused by the later tiers
+        with profiling.span('parse'):
+            self._ensure_soup(state)
+        head = state['soup'].head or state['soup']
+
+        parts = []
+        if head.title:
+            parts.append(head.title.get_text(strip=True))
+        for meta in head.find_all('meta'):
+            name = (meta.get('name') or meta.get('property') or '').lower()
+            if name in self.HEAD_META_NAMES and meta.get('content'):
+                parts.append(meta.get('content'))
+        if not parts:
+            return
+
+        prediction = self.predict(' '.join(parts))
+        self._raise_confidence(state, prediction['confidence'], prediction['details'])
 
-        # 2. Analyze image URLs for keywords
+    def _body_stage(self, state):
+        with profiling.span('get_text'):
+            self._ensure_soup(state)
+            state['text'] = state['soup'].get_text(separator=' ', strip=True)
+        profiling.annotate(text_chars=len(state['text']))
+
+        with profiling.span('text'):
+            prediction = self.predict(state['text'])
+        self._raise_confidence(state, prediction['confidence'], prediction['details'])
+
+        # No keyword or pattern hit anywhere in the head or body text (nor
+        # the URL): nothing is left for the expensive stages to weigh up
+        if state['confidence'] == 0.0 and state['url_hint'] is None:
+            state['clean'] = True
+
+    def _images_stage(self, state):
+        image_urls = state['image_urls']
         if image_urls is None:
-            image_urls = [img.get('src') for img in soup.find_all('img') if img.get('src')]
-        
+            self._ensure_soup(state)
+            image_urls = [img.get('src') for img in state['soup'].find_all('img') if img.get('src')]
+        profiling.annotate(image_urls=len(image_urls))
+
         for url in image_urls:
-            prediction = self._analyze_url_for_keywords(url)
-            if prediction:
-                try:
-                    # Create a more robust selector by matching only the filename
-                    path = urlparse(url).path
-                    filename = os.path.basename(path)
-                    
-                    # Use the filename if it's valid, otherwise fallback to the full URL
-                    if filename and '.' in filename:
-                        selector = f"img[src*='{filename}']"
-                    else:
-                        selector = f"img[src='{url}']"
-                except Exception:
-                    # Fallback to the original selector on any parsing error
-                    selector = f"img[src='{url}']"
-
-                results.append({
-                    'is_gambling': True,
-                    'confidence': prediction['confidence'],
-                    'selector': selector,
-                    'type': 'image_url',
-                    'details': {'matched_keywords': prediction['matched_keywords']}
-                })
-
-        return results
+            result = self.analyze_image_url(url)
+            if result:
+                state['image_results'].append(result)
+
+    def _model_stage(self, state):
+        if state['text'] is None:
+            return
+        confidence = self.model_confidence(state['text'])
+        details = dict(state['details'] or {'type': 'text'})
+        details['model_confidence'] = confidence
+        if confidence > state['confidence']:
+            self._raise_confidence(state, confidence, details)
+        else:
+            state['details'] = details
+
+    def _ensure_soup(self, state):
+        if state['soup'] is None:
+            state['soup'] = BeautifulSoup(state['html'], 'html.parser')
+
+    def analyze_image_url(self, url):
+        """
+        Analyzes a single image URL and returns an `image_url` result,
+        or None when the URL carries no gambling keywords.
+        """
+        prediction = self._analyze_url_for_keywords(url)
+        if not prediction:
+            return None
+        return {
+            'is_gambling': True,
+            'confidence': prediction['confidence'],
+            'selector': self._image_selector(url),
+            'type': 'image_url',
+            'details': {'matched_keywords': prediction['matched_keywords']}
+        }
+
+    def _image_selector(self, url):
+        """Builds a CSS selector that targets the <img> loading `url`."""
+        try:
+            # Create a more robust selector by matching only the filename
+            path = urlparse(url).path
+            filename = os.path.basename(path)
+
+            # Use the filename if it's valid, otherwise fallback to the full URL
+            if filename and '.' in filename:
+                return f"img[src*='{filename}']"
+            return f"img[src='{url}']"
+        except Exception:
+            # Fallback to the original selector on any parsing error
+            return f"img[src='{url}']"
 
     def _analyze_url_for_keywords(self, url):
         """Analyzes a single URL for keywords."""
@@ -262,14 +448,53 @@ class JudolDetector:
         path.reverse()
         return ' > '.join(path)
 
+    def model_features(self, texts, processed_texts=None):
+        """
+        Builds the model's feature matrix for raw `texts`: hashed terms of the
+        preprocessed text, followed by the keyword and regex scores when the
+        model was trained with them.
+        """
+        if processed_texts is None:
+            processed_texts = [self.preprocess_text(text) for text in texts]
+        features = self.vectorizer.transform(processed_texts)
+        if not self.model_keyword_features:
+            return features
+
+        scores = np.zeros((len(texts), 2), dtype=np.float64)
+        for i, text in enumerate(texts):
+            keyword_features = self.extract_keyword_features(text)
+            scores[i, 0] = keyword_features['keyword_score']
+            scores[i, 1] = keyword_features['regex_score']
+        # Same normalisation as predict(), capped so huge pages do not dominate
+        scores = np.minimum(scores / 20.0, 5.0)
+        return sp.hstack([features, sp.csr_matrix(scores)], format='csr')
+
+    def model_confidence(self, text, processed_text=None):
+        """Returns the model's gambling probability for `text`, or None without a model."""
+        if self.model is None:
+            return None
+        processed_texts = [processed_text] if processed_text is not None else None
+        features = self.model_features([text], processed_texts)
+        return float(self.model.predict_proba(features)[0, 1])
+
+    def train_model(self, corpus_path='data/corpus.ndjson', **kwargs):
+        """
+        Trains the text model out-of-core from a labelled NDJSON corpus and
+        exports it with save_model(). See train.py for the options.
+        """
+        from train import train
+
+        return train(self, corpus_path, **kwargs)
+
     def save_model(self, model_path='models/judol_model.pkl', vectorizer_path='models/vectorizer.pkl'):
         """Saves the trained model and vectorizer."""
-        if not os.path.exists('models'):
-            os.makedirs('models')
+        model_dir = os.path.dirname(model_path)
+        if model_dir and not os.path.exists(model_dir):
+            os.makedirs(model_dir)
         with open(model_path, 'wb') as f:
-            pickle.dump(self.model, f)
+            pickle.dump(self.model, f, protocol=pickle.HIGHEST_PROTOCOL)
         with open(vectorizer_path, 'wb') as f:
-            pickle.dump(self.vectorizer, f)
+            pickle.dump(self.vectorizer, f, protocol=pickle.HIGHEST_PROTOCOL)
         print(f"✅ Model saved to {model_path} and vectorizer to {vectorizer_path}")
 
     def load_model(self, model_path='models/judol_model.pkl', vectorizer_path='models/vectorizer.pkl'):
@@ -280,6 +505,12 @@ class JudolDetector:
                     self.model = pickle.load(f)
                 with open(vectorizer_path, 'rb') as f:
                     self.vectorizer = pickle.load(f)
+                # Models exported by train.py carry two extra keyword score columns
+                n_features = getattr(self.vectorizer, 'n_features', None)
+                n_model_features = getattr(self.model, 'n_features_in_', None)
+                self.model_keyword_features = (
+                    n_features is not None and n_model_features == n_features + 2
+                )
                 print(f"✅ Model loaded from {model_path} and vectorizer from {vectorizer_path}")
             else:
                 print("⚠️ Model files not found. Please train the model first.")
@@ -290,8 +521,11 @@ if __name__ == "__main__":
     # Initialize detector
     detector = JudolDetector()
     
-    # Train model
-    detector.train_model()
+    # Train the model when a corpus is available, otherwise use the exported one
+    if os.path.exists('data/corpus.ndjson'):
+        detector.train_model('data/corpus.ndjson')
+    else:
+        detector.load_model()
     
     # Test prediction
     test_texts = [
@@ -310,4 +544,8 @@ if __name__ == "__main__":
         print(f"\nText: {text}")
         print(f"Is Judol: {result['is_gambling']}")
         print(f"Confidence: {result['confidence']:.3f}")
-        print(f"Matched Keywords: {result['details']['matched_keywords']}")
+        print(f"Keyword Score: {result['details']['keyword_score']}")
+        print(f"Regex Score: {result['details']['regex_score']}")
+        model_confidence = detector.model_confidence(text)
+        if model_confidence is not None:
+            print(f"Model Confidence: {model_confidence:.3f}")
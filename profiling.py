@@ -0,0 +1,171 @@
+import contextvars
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager, nullcontext
+
+
+# Shared no-op returned by span() when no trace is active, so disabled
+# tracing costs one context variable lookup per span.
+_NOOP_SPAN = nullcontext()
+
+_current_trace = contextvars.ContextVar('judol_trace', default=None)
+
+# Fraction of requests traced without being asked to; changed at runtime
+# through the admin endpoint.
+trace_sample_rate = 0.0
+
+# Most recently finished traces, newest last
+recent_traces = deque(maxlen=100)
+
+
+class Trace:
+    """Stage-level spans recorded for a single analysis."""
+
+    def __init__(self, name, attributes=None):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.spans = []
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._depth = 0
+        self.duration = None
+
+    @contextmanager
+    def span(self, name, attributes=None):
+        start = time.perf_counter()
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            self.spans.append({
+                'name': name,
+                'depth': self._depth,
+                'start_ms': (start - self._start) * 1000,
+                'duration_ms': (time.perf_counter() - start) * 1000,
+                'attributes': attributes or {}
+            })
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._start
+
+    def stage_seconds(self):
+        """Returns the seconds spent in each top-level span, plus the total."""
+        stages = {}
+        for span in self.spans:
+            if span['depth'] == 0:
+                stages[span['name']] = stages.get(span['name'], 0.0) + span['duration_ms'] / 1000
+        stages['total'] = self.duration if self.duration is not None else time.perf_counter() - self._start
+        return stages
+
+    def server_timing(self):
+        """Formats the top-level spans as a Server-Timing header value."""
+        return ', '.join(
+            f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.stage_seconds().items()
+        )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'started_at': self.started_at,
+            'duration_ms': (self.duration or 0.0) * 1000,
+            'attributes': self.attributes,
+            'spans': sorted(self.spans, key=lambda span: span['start_ms'])
+        }
+
+
+@contextmanager
+def trace(name, force=False, **attributes):
+    """
+    Traces the enclosed block when `force` is set or the request is sampled.
+    Yields the Trace, or None when this request is not traced.
+    """
+    if not force and (trace_sample_rate <= 0 or random.random() >= trace_sample_rate):
+        yield None
+        return
+
+    current = Trace(name, attributes)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+        current.finish()
+        recent_traces.append(current)
+
+
+def span(name, **attributes):
+    """Records a span on the active trace; a no-op when nothing is being traced."""
+    current = _current_trace.get()
+    if current is None:
+        return _NOOP_SPAN
+    return current.span(name, attributes)
+
+
+def annotate(**attributes):
+    """Adds attributes (such as input sizes) to the active trace, if any."""
+    current = _current_trace.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+_profile_lock = threading.Lock()
+
+# Innermost Python frames of threads parked waiting for work: the event
+# loop's selector, thread pool queues and lock/condition waits.
+IDLE_FRAMES = {
+    ('selectors.py', 'select'),
+    ('queue.py', 'get'),
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    ('thread.py', '_worker'),
+}
+
+
+def _is_idle(frame):
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+
+def sample_stacks(seconds=10.0, interval=0.01):
+    """
+    Sampling profile of the busy threads in this worker.
+
+    Samples all thread stacks every `interval` seconds for `seconds` and
+    returns them in collapsed-stack format ("frame;frame;frame count"),
+    ready for flamegraph tools. Samples of threads idling in a known wait
+    (see IDLE_FRAMES) are dropped, so the counts approximate where CPU time
+    goes; a busy thread waiting for the GIL is still counted. Only one
+    profile runs at a time; returns None if another is already in progress.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        own_thread = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        counts = Counter()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread or _is_idle(frame):
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                    frame = frame.f_back
+                frames.append(names.get(thread_id, str(thread_id)))
+                frames.reverse()
+                counts[';'.join(frames)] += 1
+            time.sleep(interval)
+    finally:
+        _profile_lock.release()
+
+    return '\n'.join(f"{stack} {count}" for stack, count in counts.most_common())
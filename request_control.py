@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import ipaddress
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def content_fingerprint(html, url=None, image_urls=None):
+    """Returns a stable fingerprint for an analysis request's content."""
+    digest = hashlib.sha256()
+    digest.update((url or '').encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(json.dumps(image_urls).encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(html.encode('utf-8', errors='replace'))
+    return digest.hexdigest()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into a single computation.
+
+    The first caller for a key starts the computation; callers arriving
+    while it is still running wait on the same task and receive its result
+    (or exception). The computation runs as its own task, so a caller that
+    disconnects does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._inflight)
+
+    async def do(self, key, fn):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+
+class TokenBucketLimiter:
+    """
+    Per-client token-bucket rate limiter.
+
+    Each client may burst up to `burst` requests and is then refilled at
+    `rate` requests per second. Only the `max_clients` most recently seen
+    clients are tracked; older buckets are dropped, which only ever errs
+    on the side of allowing a request.
+    """
+
+    def __init__(self, rate=5.0, burst=20, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """
+        Builds a limiter from JUDOL_RATE_LIMIT_PER_SECOND and JUDOL_RATE_LIMIT_BURST.
+        Returns None when the rate is unset or 0, which disables limiting.
+        """
+        rate = float(os.environ.get('JUDOL_RATE_LIMIT_PER_SECOND', '0'))
+        if rate <= 0:
+            return None
+        burst = int(os.environ.get('JUDOL_RATE_LIMIT_BURST', '20'))
+        return cls(rate=rate, burst=burst)
+
+    def acquire(self, client_id):
+        """
+        Takes a token for `client_id`. Returns 0 when the request is allowed,
+        otherwise the number of seconds until a token becomes available.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(client_id, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                retry_after = 0.0
+            else:
+                retry_after = (1 - tokens) / self.rate
+            self._buckets[client_id] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+
+def parse_trusted_proxies(value):
+    """Parses a comma-separated list of proxy addresses or CIDR ranges."""
+    networks = []
+    for entry in (value or '').split(','):
+        entry = entry.strip()
+        if entry:
+            networks.append(ipaddress.ip_network(entry, strict=False))
+    return networks
+
+
+def _is_trusted(address, trusted_proxies):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted_proxies)
+
+
+def client_address(peer, forwarded_for, trusted_proxies):
+    """
+    Returns the address of the client behind any trusted reverse proxies.
+
+    X-Forwarded-For is only believed when the connecting peer is a trusted
+    proxy, and is then walked from the right (nearest hop) past further
+    trusted proxies, so a client cannot choose its own address by sending
+    the header itself.
+    """
+    address = peer
+    if not forwarded_for or not _is_trusted(peer, trusted_proxies):
+        return address
+    for hop in reversed(forwarded_for.split(',')):
+        hop = hop.strip()
+        if not hop:
+            continue
+        address = hop
+        if not _is_trusted(hop, trusted_proxies):
+            break
+    return address
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+"""
+Shadow evaluation harness for comparing two JudolDetector configurations.
+
+Replays requests recorded by the API's traffic log (see traffic_log.py)
+through a baseline and a candidate detector in parallel worker processes
+and reports verdict/selector differences next to per-stage latency and
+throughput, so a rule change or optimization can be judged on accuracy
+and speed together.
+
+A configuration is a JSON file with any of these keys:
+
+    {"keywords_file": "keywords.csv", "regex_patterns": [{"keyword": "slot\\\\d*", "score": 15}]}
+
+Usage:
+
+    python shadow_eval.py traffic.ndjson --candidate candidate.json --workers 4
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import profiling
+from traffic_log import iter_records
+
+STAGES = ['url', 'head', 'body', 'images', 'model', 'total']
+
+_detectors = {}
+
+
+def load_config(path):
+    if not path:
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _init_worker(configs):
+    # Imported here so the parent process does not pay for building detectors
+    from judol_detector import JudolDetector
+
+    for name, config in configs.items():
+        # Caching is disabled so neither side can be served the other's verdicts
+        _detectors[name] = JudolDetector(
+            keywords_file=config.get('keywords_file', 'keywords.csv'),
+            regex_patterns=config.get('regex_patterns'),
+            use_cache=False
+        )
+
+
+def _replay(index, record):
+    names = sorted(_detectors)
+    # Alternate the order so warm-up effects do not favour one side
+    if index % 2:
+        names.reverse()
+
+    outcome = {}
+    for name in names:
+        with profiling.trace('shadow_eval', force=True) as trace:
+            results = _detectors[name].analyze_html_content(
+                html_content=record['html'],
+                base_url=record.get('url'),
+                image_urls=record.get('image_urls')
+            )
+        outcome[name] = {
+            'page_gambling': any(r['type'] == 'text' for r in results),
+            'selectors': sorted({r['selector'] for r in results}),
+            'timings': trace.stage_seconds()
+        }
+    outcome['url'] = record.get('url')
+    return outcome
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def _latency_summary(samples):
+    summary = {}
+    for stage in STAGES:
+        values = samples.get(stage, [])
+        summary[stage] = {
+            'mean_ms': (sum(values) / len(values) * 1000) if values else 0.0,
+            'p50_ms': _percentile(values, 50) * 1000,
+            'p95_ms': _percentile(values, 95) * 1000,
+            'p99_ms': _percentile(values, 99) * 1000
+        }
+    total = sum(samples.get('total', []))
+    summary['pages_per_second_per_worker'] = len(samples.get('total', [])) / total if total else 0.0
+    return summary
+
+
+def run(log_path, baseline, candidate, workers=None, limit=None, max_examples=20):
+    configs = {'baseline': baseline, 'candidate': candidate}
+    workers = workers or os.cpu_count() or 1
+
+    latencies = {'baseline': {}, 'candidate': {}}
+    stage_runs = {'baseline': {}, 'candidate': {}}
+    report = {
+        'records': 0,
+        'identical': 0,
+        'page_newly_flagged': 0,
+        'page_no_longer_flagged': 0,
+        'selectors_added': 0,
+        'selectors_removed': 0,
+        'examples': []
+    }
+
+    def collect(outcome):
+        report['records'] += 1
+        base, cand = outcome['baseline'], outcome['candidate']
+        for name in ('baseline', 'candidate'):
+            for stage, seconds in outcome[name]['timings'].items():
+                latencies[name].setdefault(stage, []).append(seconds)
+                stage_runs[name][stage] = stage_runs[name].get(stage, 0) + 1
+
+        added = sorted(set(cand['selectors']) - set(base['selectors']))
+        removed = sorted(set(base['selectors']) - set(cand['selectors']))
+        report['selectors_added'] += len(added)
+        report['selectors_removed'] += len(removed)
+        if cand['page_gambling'] and not base['page_gambling']:
+            report['page_newly_flagged'] += 1
+        elif base['page_gambling'] and not cand['page_gambling']:
+            report['page_no_longer_flagged'] += 1
+
+        if not added and not removed and base['page_gambling'] == cand['page_gambling']:
+            report['identical'] += 1
+        elif len(report['examples']) < max_examples:
+            report['examples'].append({
+                'url': outcome['url'],
+                'baseline_page_gambling': base['page_gambling'],
+                'candidate_page_gambling': cand['page_gambling'],
+                'selectors_added': added,
+                'selectors_removed': removed
+            })
+
+    started = time.perf_counter()
+    # Keep a bounded number of records in flight so large logs are streamed
+    max_in_flight = workers * 4
+    # Workers are spawned rather than forked: polars' thread pool is not fork-safe
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=(configs,)) as pool:
+        pending = set()
+        for index, record in enumerate(iter_records(log_path, limit=limit)):
+            pending.add(pool.submit(_replay, index, record))
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future.result())
+        for future in pending:
+            collect(future.result())
+    elapsed = time.perf_counter() - started
+
+    report['workers'] = workers
+    report['wall_seconds'] = elapsed
+    report['pages_per_second'] = report['records'] / elapsed if elapsed else 0.0
+    report['latency'] = {name: _latency_summary(samples) for name, samples in latencies.items()}
+    # How many pages reached each tier of the detection pipeline
+    report['stage_runs'] = stage_runs
+    return report
+
+
+def print_report(report):
+    print("\n" + "=" * 50)
+    print("Shadow evaluation")
+    print("=" * 50)
+    print(f"Records replayed: {report['records']} "
+          f"({report['pages_per_second']:.1f} pages/s on {report['workers']} workers)")
+    print(f"Identical verdicts: {report['identical']}")
+    print(f"Pages newly flagged: {report['page_newly_flagged']}")
+    print(f"Pages no longer flagged: {report['page_no_longer_flagged']}")
+    print(f"Selectors added / removed: {report['selectors_added']} / {report['selectors_removed']}")
+
+    print("\nLatency (ms)          baseline p50/p95     candidate p50/p95     pages reaching stage")
+    for stage in STAGES:
+        base = report['latency']['baseline'][stage]
+        cand = report['latency']['candidate'][stage]
+        runs = (report['stage_runs']['baseline'].get(stage, 0), report['stage_runs']['candidate'].get(stage, 0))
+        print(f"  {stage:<20}{base['p50_ms']:>8.2f} /{base['p95_ms']:>8.2f}"
+              f"     {cand['p50_ms']:>8.2f} /{cand['p95_ms']:>8.2f}"
+              f"     {runs[0]} / {runs[1]}")
+    print(f"  {'pages/s per worker':<20}"
+          f"{report['latency']['baseline']['pages_per_second_per_worker']:>18.1f}"
+          f"{report['latency']['candidate']['pages_per_second_per_worker']:>24.1f}")
+
+    if report['examples']:
+        print("\nExample differences:")
+        for example in report['examples']:
+            print(f"  - {example['url']}: page {example['baseline_page_gambling']} -> "
+                  f"{example['candidate_page_gambling']}, "
+                  f"+{example['selectors_added']} -{example['selectors_removed']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded traffic through two detector configurations.")
+    parser.add_argument('log', help="Path to the NDJSON traffic log")
+    parser.add_argument('--baseline', help="Baseline configuration JSON (defaults to the current detector)")
+    parser.add_argument('--candidate', help="Candidate configuration JSON (defaults to the current detector)")
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes")
+    parser.add_argument('--limit', type=int, default=None, help="Replay at most this many records")
+    parser.add_argument('--examples', type=int, default=20, help="Number of differing records to list")
+    parser.add_argument('--report', help="Write the full report as JSON to this path")
+    args = parser.parse_args()
+
+    report = run(
+        args.log,
+        load_config(args.baseline),
+        load_config(args.candidate),
+        workers=args.workers,
+        limit=args.limit,
+        max_examples=args.examples
+    )
+    print_report(report)
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✅ Report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import fcntl
+import json
+import os
+import random
+import threading
+import time
+
+
+class TrafficRecorder:
+    """
+    Records a sample of analysis requests to a local NDJSON log.
+
+    The log is size-bounded: once the active file would exceed `max_bytes`
+    it is rotated to `<path>.1`, replacing the previous rotation, so at most
+    about twice `max_bytes` is kept on disk. Rotation and appends hold an
+    exclusive lock on `<path>.lock`, so several worker processes can share
+    one log.
+    """
+
+    def __init__(self, path, sample_rate=0.01, max_bytes=50 * 1024 * 1024):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Builds a recorder from JUDOL_RECORD_PATH, JUDOL_RECORD_SAMPLE_RATE and
+        JUDOL_RECORD_MAX_BYTES. Returns None when recording is not configured.
+        """
+        path = os.environ.get('JUDOL_RECORD_PATH')
+        if not path:
+            return None
+        return cls(
+            path,
+            sample_rate=float(os.environ.get('JUDOL_RECORD_SAMPLE_RATE', '0.01')),
+            max_bytes=int(os.environ.get('JUDOL_RECORD_MAX_BYTES', str(50 * 1024 * 1024)))
+        )
+
+    def sampled(self):
+        """Decides whether the next request should be recorded."""
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def maybe_record(self, html, url=None, image_urls=None):
+        """Records the request with probability `sample_rate`. Returns True if recorded."""
+        if not self.sampled():
+            return False
+        return self.record(html, url=url, image_urls=image_urls)
+
+    def record(self, html, url=None, image_urls=None):
+        line = json.dumps({
+            'ts': time.time(),
+            'url': url,
+            'image_urls': image_urls,
+            'html': html
+        }, ensure_ascii=False) + '\n'
+        data = line.encode('utf-8')
+        if len(data) > self.max_bytes:
+            return False
+
+        try:
+            with self._lock, open(self.path + '.lock', 'a') as lock_file:
+                # The thread lock only covers this process; other workers
+                # appending to or rotating the same log wait on the file lock
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+                if size + len(data) > self.max_bytes:
+                    os.replace(self.path, self.path + '.1')
+                with open(self.path, 'ab') as f:
+                    f.write(data)
+        except OSError as e:
+            print(f"⚠️ Traffic log write error: {e}")
+            return False
+        return True
+
+
+def iter_records(path, limit=None):
+    """
+    Yields recorded requests from `path`, oldest first, including its
+    rotated `<path>.1` file when present. Malformed lines are skipped.
+    """
+    count = 0
+    for candidate in (path + '.1', path):
+        if not os.path.exists(candidate):
+            continue
+        with open(candidate, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if not isinstance(record, dict) or 'html' not in record:
+                    continue
+                yield record
+                count += 1
+                if limit is not None and count >= limit:
+                    return
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+
+"""
+Out-of-core training pipeline for the judol text model.
+
+Streams a labelled NDJSON corpus in chunks, one JSON object per line:
+
+    {"text": "Slot gacor maxwin hari ini", "label": 1}
+    {"html": "<html>...</html>", "label": 0}
+
+The main process only reads and splits raw lines; parsing, HTML text
+extraction and featurization happen in parallel worker processes. Text
+is hashed (no vocabulary is held in memory) and extended with the
+detector's keyword and regex scores, while the main process fits an SGD
+logistic regression with partial_fit on rows shuffled through a small
+buffer of chunks, so memory stays bounded by the chunk size regardless
+of corpus size. A deterministic hash split holds out a test set, on which
+the model is compared with the keyword-only detector on both accuracy and
+per-page inference latency. The result is exported with save_model() for
+load_model().
+
+Usage:
+
+    python train.py data/corpus.ndjson --workers 8 --epochs 2
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+import scipy.sparse as sp
+from bs4 import BeautifulSoup
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+
+POSITIVE_LABELS = {'1', 'true', 'gambling', 'judol', 'positive'}
+CLASSES = np.array([0, 1])
+
+_worker_detector = None
+
+
+def parse_label(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return int(value > 0)
+    return int(str(value).strip().lower() in POSITIVE_LABELS)
+
+
+def iter_corpus(path):
+    """
+    Yields the raw, non-blank lines of an NDJSON corpus. Decoding and HTML
+    text extraction are left to the featurization workers.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def parse_record(line):
+    """Returns the (text, label) of a corpus line, or None if it is malformed."""
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(record, dict) or 'label' not in record:
+        return None
+    text = record.get('text')
+    if text is None and record.get('html') is not None:
+        text = BeautifulSoup(record['html'], 'html.parser').get_text(separator=' ', strip=True)
+    if not isinstance(text, str) or not text:
+        return None
+    return text, parse_label(record['label'])
+
+
+def is_test_sample(line, test_percent):
+    # Hash split on the raw line: stable across epochs and runs without
+    # holding an index or parsing the record
+    digest = hashlib.md5(line.encode('utf-8', errors='replace')).digest()
+    return digest[0] * 100 // 256 < test_percent
+
+
+def iter_chunks(path, chunk_size, test_percent):
+    """Yields ('train' | 'test', lines) chunks of raw corpus lines."""
+    buffers = {'train': [], 'test': []}
+    for line in iter_corpus(path):
+        split = 'test' if is_test_sample(line, test_percent) else 'train'
+        lines = buffers[split]
+        lines.append(line)
+        if len(lines) >= chunk_size:
+            yield split, lines
+            buffers[split] = []
+    for split, lines in buffers.items():
+        if lines:
+            yield split, lines
+
+
+def build_vectorizer(n_features):
+    return HashingVectorizer(
+        n_features=n_features,
+        ngram_range=(1, 2),
+        alternate_sign=False,
+        norm='l2'
+    )
+
+
+def _init_worker(n_features, keyword_features):
+    global _worker_detector
+    from judol_detector import JudolDetector
+
+    _worker_detector = JudolDetector(use_cache=False)
+    _worker_detector.vectorizer = build_vectorizer(n_features)
+    _worker_detector.model_keyword_features = keyword_features
+
+
+def _featurize(lines, evaluate, sample_texts=0):
+    """
+    Parses and featurizes a chunk of raw corpus lines. Returns the features
+    (None if no line was usable), the labels, the keyword-only verdicts when
+    evaluating, and up to `sample_texts` extracted texts.
+    """
+    texts, labels = [], []
+    for line in lines:
+        parsed = parse_record(line)
+        if parsed is not None:
+            texts.append(parsed[0])
+            labels.append(parsed[1])
+    if not texts:
+        return None, np.asarray(labels), [], []
+
+    features = _worker_detector.model_features(texts)
+    keyword_verdicts = None
+    if evaluate:
+        # The keyword-only detector's verdicts, for comparison with the model
+        keyword_verdicts = []
+        for text in texts:
+            keyword_features = _worker_detector.extract_keyword_features(text)
+            total_score = keyword_features['keyword_score'] + keyword_features['regex_score']
+            keyword_verdicts.append(min(1.0, total_score / 20.0) > 0.5)
+    return features, np.asarray(labels), keyword_verdicts, texts[:sample_texts]
+
+
+def _featurized_chunks(pool, path, split, chunk_size, test_percent, workers, sample_texts=None):
+    """
+    Featurizes the chunks of one split across the pool, keeping a bounded
+    number in flight. `sample_texts`, if given, returns how many extracted
+    texts are still wanted back from the workers.
+    """
+    evaluate = split == 'test'
+    pending = set()
+
+    def finished(futures):
+        for future in futures:
+            result = future.result()
+            if result[0] is not None:
+                yield result
+
+    for chunk_split, lines in iter_chunks(path, chunk_size, test_percent):
+        if chunk_split != split:
+            continue
+        wanted = sample_texts() if sample_texts else 0
+        pending.add(pool.submit(_featurize, lines, evaluate, wanted))
+        if len(pending) >= workers * 2:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from finished(done)
+    yield from finished(pending)
+
+
+def _shuffled(chunks, rng, chunk_size, buffer_chunks):
+    """
+    Re-chunks featurized training chunks in a random order. Rows from up to
+    `buffer_chunks` chunks are pooled and drawn at random, so a corpus built
+    from long single-class runs does not reach partial_fit one class at a
+    time, while memory stays bounded by the buffer.
+    """
+    features_buffer, labels_buffer = None, None
+    for features, labels, _, _ in chunks:
+        if features_buffer is None:
+            features_buffer, labels_buffer = features, labels
+        else:
+            features_buffer = sp.vstack([features_buffer, features], format='csr')
+            labels_buffer = np.concatenate([labels_buffer, labels])
+        if len(labels_buffer) < buffer_chunks * chunk_size:
+            continue
+        order = rng.permutation(len(labels_buffer))
+        take, keep = order[:chunk_size], order[chunk_size:]
+        yield features_buffer[take], labels_buffer[take]
+        features_buffer, labels_buffer = features_buffer[keep], labels_buffer[keep]
+
+    if features_buffer is not None:
+        order = rng.permutation(len(labels_buffer))
+        for start in range(0, len(order), chunk_size):
+            take = order[start:start + chunk_size]
+            yield features_buffer[take], labels_buffer[take]
+
+
+class _Scores:
+    def __init__(self):
+        self.tp = self.fp = self.tn = self.fn = 0
+
+    def update(self, predicted, actual):
+        predicted = np.asarray(predicted, dtype=bool)
+        actual = np.asarray(actual, dtype=bool)
+        self.tp += int(np.sum(predicted & actual))
+        self.fp += int(np.sum(predicted & ~actual))
+        self.tn += int(np.sum(~predicted & ~actual))
+        self.fn += int(np.sum(~predicted & actual))
+
+    def summary(self):
+        total = self.tp + self.fp + self.tn + self.fn
+        precision = self.tp / (self.tp + self.fp) if self.tp + self.fp else 0.0
+        recall = self.tp / (self.tp + self.fn) if self.tp + self.fn else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        return {
+            'samples': total,
+            'accuracy': (self.tp + self.tn) / total if total else 0.0,
+            'precision': precision,
+            'recall': recall,
+            'f1': f1
+        }
+
+
+def _latency_ms(fn, texts):
+    timings = []
+    for text in texts:
+        start = time.perf_counter()
+        fn(text)
+        timings.append((time.perf_counter() - start) * 1000)
+    if not timings:
+        return {'mean_ms': 0.0, 'p50_ms': 0.0, 'p95_ms': 0.0}
+    return {
+        'mean_ms': float(np.mean(timings)),
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p95_ms': float(np.percentile(timings, 95))
+    }
+
+
+def train(detector, corpus_path, chunk_size=2000, workers=None, epochs=1, n_features=2 ** 20,
+          keyword_features=True, test_percent=10, latency_sample=500, alpha=1e-6,
+          shuffle_buffer=8, seed=42,
+          model_path='models/judol_model.pkl', vectorizer_path='models/vectorizer.pkl'):
+    """
+    Trains `detector`'s text model from `corpus_path`, evaluates it on the
+    held-out split and exports it. Training rows are shuffled within a
+    window of `shuffle_buffer` chunks, in a new order every epoch. Returns
+    the evaluation report.
+    """
+    if not os.path.exists(corpus_path):
+        print(f"❌ Training corpus not found: {corpus_path}")
+        return None
+
+    workers = workers or os.cpu_count() or 1
+    detector.vectorizer = build_vectorizer(n_features)
+    detector.model_keyword_features = keyword_features
+    model = SGDClassifier(loss='log_loss', alpha=alpha, random_state=seed)
+    rng = np.random.default_rng(seed)
+
+    started = time.perf_counter()
+    trained = 0
+    model_scores = _Scores()
+    keyword_scores = _Scores()
+    latency_texts = []
+
+    def latency_texts_wanted():
+        return max(0, latency_sample - len(latency_texts))
+
+    # Workers are spawned rather than forked: polars' thread pool is not fork-safe
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=(n_features, keyword_features)) as pool:
+        for epoch in range(epochs):
+            chunks = _featurized_chunks(pool, corpus_path, 'train', chunk_size, test_percent, workers)
+            for features, labels in _shuffled(chunks, rng, chunk_size, shuffle_buffer):
+                model.partial_fit(features, labels, classes=CLASSES)
+                trained += len(labels)
+            print(f"✅ Epoch {epoch + 1}/{epochs} done ({trained} training samples so far)")
+        train_seconds = time.perf_counter() - started
+
+        if not hasattr(model, 'coef_'):
+            print("❌ No training samples found in the corpus.")
+            return None
+
+        # Evaluate the model and the keyword-only detector on the held-out split
+        for features, labels, keyword_verdicts, texts in _featurized_chunks(
+                pool, corpus_path, 'test', chunk_size, test_percent, workers,
+                sample_texts=latency_texts_wanted):
+            model_scores.update(model.predict(features), labels)
+            keyword_scores.update(keyword_verdicts, labels)
+            latency_texts.extend(texts[:latency_texts_wanted()])
+
+    # A mostly-zero weight vector is cheaper to store and load as sparse
+    if np.count_nonzero(model.coef_) < 0.25 * model.coef_.size:
+        model.sparsify()
+    detector.model = model
+    detector.save_model(model_path, vectorizer_path)
+
+    report = {
+        'training_samples': trained // epochs,
+        'training_seconds': train_seconds,
+        'samples_per_second': trained / train_seconds if train_seconds else 0.0,
+        'model': model_scores.summary(),
+        'keywords_only': keyword_scores.summary(),
+        'model_latency': _latency_ms(detector.model_confidence, latency_texts),
+        'keywords_only_latency': _latency_ms(detector.extract_keyword_features, latency_texts),
+        'artifact_bytes': os.path.getsize(model_path) + os.path.getsize(vectorizer_path)
+    }
+    print_report(report)
+    return report
+
+
+def print_report(report):
+    print("\n" + "=" * 50)
+    print("Training report")
+    print("=" * 50)
+    print(f"Training samples: {report['training_samples']} "
+          f"({report['samples_per_second']:.0f} samples/s, {report['training_seconds']:.1f}s)")
+    print(f"Artifact size: {report['artifact_bytes'] / 1024:.0f} KB")
+    print("\n                    model      keywords only")
+    for metric in ('accuracy', 'precision', 'recall', 'f1'):
+        print(f"  {metric:<16}{report['model'][metric]:>8.3f}{report['keywords_only'][metric]:>14.3f}")
+    for metric in ('mean_ms', 'p50_ms', 'p95_ms'):
+        print(f"  latency {metric:<8}{report['model_latency'][metric]:>8.3f}"
+              f"{report['keywords_only_latency'][metric]:>14.3f}")
+    print(f"  test samples    {report['model']['samples']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train and export the judol text model from an NDJSON corpus.")
+    parser.add_argument('corpus', nargs='?', default='data/corpus.ndjson', help="Path to the labelled NDJSON corpus")
+    parser.add_argument('--chunk-size', type=int, default=2000, help="Records per training chunk")
+    parser.add_argument('--workers', type=int, default=None, help="Featurization worker processes")
+    parser.add_argument('--epochs', type=int, default=1, help="Passes over the training split")
+    parser.add_argument('--n-features', type=int, default=2 ** 20, help="Size of the hashed feature space")
+    parser.add_argument('--no-keyword-features', action='store_true', help="Do not add keyword scores as features")
+    parser.add_argument('--test-percent', type=int, default=10, help="Percentage of the corpus held out for evaluation")
+    parser.add_argument('--alpha', type=float, default=1e-6, help="SGD regularization strength")
+    parser.add_argument('--shuffle-buffer', type=int, default=8, help="Chunks whose rows are shuffled together")
+    parser.add_argument('--seed', type=int, default=42, help="Seed for shuffling and SGD")
+    parser.add_argument('--model-path', default='models/judol_model.pkl')
+    parser.add_argument('--vectorizer-path', default='models/vectorizer.pkl')
+    parser.add_argument('--report', help="Write the evaluation report as JSON to this path")
+    args = parser.parse_args()
+
+    from judol_detector import JudolDetector
+
+    detector = JudolDetector(use_cache=False)
+    report = train(
+        detector,
+        args.corpus,
+        chunk_size=args.chunk_size,
+        workers=args.workers,
+        epochs=args.epochs,
+        n_features=args.n_features,
+        keyword_features=not args.no_keyword_features,
+        test_percent=args.test_percent,
+        alpha=args.alpha,
+        shuffle_buffer=args.shuffle_buffer,
+        seed=args.seed,
+        model_path=args.model_path,
+        vectorizer_path=args.vectorizer_path
+    )
+    if report and args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✅ Report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import redis
+
+
+DEFAULT_TTL = 3600
+
+
+class RedisVerdictCache:
+    """Verdict cache backed by Redis, using native key expiry."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key):
+        try:
+            cached_result = self.client.get(key)
+            if cached_result:
+                return json.loads(cached_result)
+        except redis.exceptions.RedisError as e:
+            print(f"⚠️ Redis cache read error: {e}")
+        return None
+
+    def set(self, key, value, ttl=DEFAULT_TTL):
+        try:
+            self.client.setex(key, ttl, json.dumps(value))
+        except redis.exceptions.RedisError as e:
+            print(f"⚠️ Redis cache write error: {e}")
+
+    def remaining_ttl(self, key):
+        """Returns the seconds until `key` expires, or None if unknown."""
+        try:
+            remaining = self.client.ttl(key)
+        except redis.exceptions.RedisError as e:
+            print(f"⚠️ Redis cache read error: {e}")
+            return None
+        # Redis reports -2 for a missing key and -1 for one without expiry
+        return remaining if remaining is not None and remaining >= 0 else None
+
+
+class DiskVerdictCache:
+    """
+    Embedded on-disk verdict store for deployments without Redis.
+
+    Entries live in a single SQLite file opened in WAL mode with a
+    memory-mapped read path, so any number of worker processes can read
+    concurrently while one writes, and the store survives restarts.
+    Every entry carries its own expiry; once the stored payload exceeds
+    `max_bytes`, expired entries and then the entries closest to expiry
+    are evicted. Reads never write, keeping them contention-free.
+    """
+
+    # How many writes happen between checks of the total stored size
+    EVICTION_CHECK_INTERVAL = 64
+
+    def __init__(self, path='cache/verdicts.db', max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS verdicts ("
+                " key BLOB PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " size INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS verdicts_expires_at ON verdicts (expires_at)")
+        # Warm start: keep what is still valid from the previous run
+        self.purge_expired()
+
+    def _connection(self):
+        # SQLite connections must not be shared across threads, and are
+        # opened lazily so forked worker processes get their own.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={int(self.max_bytes * 2)}")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _hash_key(key):
+        # Text keys can be whole pages; store a fixed-size digest instead
+        return hashlib.sha256(key.encode('utf-8', errors='replace')).digest()
+
+    def get(self, key):
+        try:
+            row = self._connection().execute(
+                "SELECT value FROM verdicts WHERE key = ? AND expires_at > ?",
+                (self._hash_key(key), time.time())
+            ).fetchone()
+            if row:
+                return json.loads(row[0])
+        except sqlite3.Error as e:
+            print(f"⚠️ Disk cache read error: {e}")
+        return None
+
+    def set(self, key, value, ttl=DEFAULT_TTL):
+        payload = json.dumps(value)
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO verdicts (key, value, expires_at, size) VALUES (?, ?, ?, ?)",
+                (self._hash_key(key), payload, time.time() + ttl, len(payload) + 32)
+            )
+        except sqlite3.Error as e:
+            print(f"⚠️ Disk cache write error: {e}")
+            return
+
+        with self._lock:
+            self._writes += 1
+            check = self._writes % self.EVICTION_CHECK_INTERVAL == 0
+        if check:
+            self.evict()
+
+    def purge_expired(self):
+        try:
+            self._connection().execute("DELETE FROM verdicts WHERE expires_at <= ?", (time.time(),))
+        except sqlite3.Error as e:
+            print(f"⚠️ Disk cache purge error: {e}")
+
+    def evict(self):
+        """Brings the stored payload back under `max_bytes`, leaving some headroom."""
+        try:
+            conn = self._connection()
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM verdicts").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            self.purge_expired()
+            target = int(self.max_bytes * 0.9)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM verdicts").fetchone()[0]
+                # Drop the entries that would expire soonest first
+                for key, size in conn.execute(
+                    "SELECT key, size FROM verdicts ORDER BY expires_at"
+                ).fetchall():
+                    if total <= target:
+                        break
+                    conn.execute("DELETE FROM verdicts WHERE key = ?", (key,))
+                    total -= size
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            print(f"⚠️ Disk cache eviction error: {e}")
+
+
+class TieredVerdictCache:
+    """
+    Checks a fast local cache before a shared one and writes through to both.
+
+    Hits from the shared cache are copied to the local one for whatever
+    lifetime they have left there (or `ttl` when that is unknown), so the
+    local copy never outlives the shared entry.
+    """
+
+    def __init__(self, front, back, ttl=DEFAULT_TTL):
+        self.front = front
+        self.back = back
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.front.get(key)
+        if value is not None:
+            return value
+        value = self.back.get(key)
+        if value is not None:
+            remaining = None
+            if hasattr(self.back, 'remaining_ttl'):
+                remaining = self.back.remaining_ttl(key)
+            ttl = self.ttl if remaining is None else min(remaining, self.ttl)
+            if ttl > 0:
+                self.front.set(key, value, ttl)
+        return value
+
+    def set(self, key, value, ttl=DEFAULT_TTL):
+        self.front.set(key, value, ttl)
+        self.back.set(key, value, ttl)
+
+
+def build_cache(backend=None, ttl=DEFAULT_TTL):
+    """
+    Builds the verdict cache selected by JUDOL_CACHE_BACKEND:
+
+    - `redis` (default): Redis at JUDOL_REDIS_HOST / JUDOL_REDIS_PORT
+    - `disk`: the on-disk store at JUDOL_CACHE_PATH, bounded by JUDOL_CACHE_MAX_BYTES
+    - `disk+redis`: the on-disk store in front of Redis
+    - `none`: no caching
+
+    `ttl` is the lifetime given to entries copied between tiers.
+    Returns None for `none`.
+    """
+    backend = (backend or os.environ.get('JUDOL_CACHE_BACKEND', 'redis')).lower()
+    if backend == 'none':
+        return None
+
+    def redis_cache():
+        return RedisVerdictCache(redis.StrictRedis(
+            host=os.environ.get('JUDOL_REDIS_HOST', 'redis'),
+            port=int(os.environ.get('JUDOL_REDIS_PORT', '6379')),
+            db=0
+        ))
+
+    def disk_cache():
+        return DiskVerdictCache(
+            path=os.environ.get('JUDOL_CACHE_PATH', 'cache/verdicts.db'),
+            max_bytes=int(os.environ.get('JUDOL_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+        )
+
+    if backend == 'redis':
+        return redis_cache()
+    if backend == 'disk':
+        return disk_cache()
+    if backend == 'disk+redis':
+        return TieredVerdictCache(disk_cache(), redis_cache(), ttl=ttl)
+    raise ValueError(f"Unknown cache backend: {backend}")